@@ -1,21 +1,97 @@
+import logging
+from contextvars import ContextVar
 from psycopg_pool import ConnectionPool
 from psycopg.rows import dict_row
+from datetime import datetime
 from typing import Any, Dict, List, Optional, Iterable, Tuple
-from .config import DATABASE_URL, RESULT_LIMIT_DEFAULT, ANN_PROBES
+from .config import (
+    DATABASE_URL, DATABASE_READ_URL, RESULT_LIMIT_DEFAULT, ANN_PROBES,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_READ_POOL_MIN_SIZE, DB_READ_POOL_MAX_SIZE,
+)
+
+log = logging.getLogger(__name__)
 
 def _normalize_conninfo(url: str) -> str:
     return url.replace("postgresql+psycopg", "postgresql")
 
-pool = ConnectionPool(conninfo=DATABASE_URL, min_size=1, max_size=5)
+# Primary: all writes, plus reads that must see them.
+pool = ConnectionPool(
+    conninfo=_normalize_conninfo(DATABASE_URL),
+    min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+)
+
+# Optional replica for search/list reads; None means everything uses the primary.
+read_pool: Optional[ConnectionPool] = (
+    ConnectionPool(
+        conninfo=_normalize_conninfo(DATABASE_READ_URL),
+        min_size=DB_READ_POOL_MIN_SIZE, max_size=DB_READ_POOL_MAX_SIZE,
+    )
+    if DATABASE_READ_URL else None
+)
+
+# Per-request routing state, set by the HTTP middleware:
+#   pinned -> client wrote recently, keep its reads on the primary
+#   wrote  -> this request has written to the primary
+_route: ContextVar[Optional[Dict[str, bool]]] = ContextVar("db_route", default=None)
+
+def begin_request(pinned: bool = False):
+    return _route.set({"pinned": pinned, "wrote": False})
+
+def end_request(token) -> bool:
+    """Reset routing state; returns True if the request wrote to the primary."""
+    state = _route.get()
+    _route.reset(token)
+    return bool(state and state["wrote"])
+
+def _writer() -> ConnectionPool:
+    state = _route.get()
+    if state is not None:
+        state["wrote"] = True
+    return pool
+
+def _reader() -> ConnectionPool:
+    if read_pool is None:
+        return pool
+    state = _route.get()
+    if state is not None and (state["pinned"] or state["wrote"]):
+        return pool
+    return read_pool
 
 def init_db() -> None:
-    with pool.connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1;")
-            cur.fetchone()
+    for p in (pool, read_pool):
+        if p is None:
+            continue
+        with p.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+                cur.fetchone()
+
+    ensure_note_partitions()
+
+def ensure_note_partitions(months_ahead: int = 3) -> None:
+    """
+    If notes is partitioned (partition_notes.sql), create upcoming partitions.
+    Failures are logged rather than raised; inserts still land in notes_default.
+    """
+    try:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.notes');")
+                row = cur.fetchone()
+                if not row or row[0] != "p":
+                    return
+                cur.execute(
+                    "SELECT notes_ensure_partitions(now(), now() + make_interval(months => %s));",
+                    (months_ahead,),
+                )
+                conn.commit()
+    except Exception:
+        log.exception("Could not create upcoming notes partitions")
 
 def close_db() -> None:
     pool.close()
+    if read_pool is not None:
+        read_pool.close()
 
 
 def db_diagnostics() -> Dict[str, Any]:
@@ -61,20 +137,32 @@ def db_diagnostics() -> Dict[str, Any]:
 
     return data
 
-def fetchall(sql: str, params: Optional[tuple] = None) -> List[tuple]:
-    with pool.connection() as conn:
+# Reads: replica=True may use the read pool, otherwise the primary is read
+# without marking the request as a write. Writes go through execute /
+# execute_returning, which pin the client to the primary.
+def fetchall(sql: str, params: Optional[tuple] = None, replica: bool = False) -> List[tuple]:
+    with (_reader() if replica else pool).connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params or ())
             return cur.fetchall()
 
-def fetchone(sql: str, params: Optional[tuple] = None) -> Optional[tuple]:
-    with pool.connection() as conn:
+def fetchone(sql: str, params: Optional[tuple] = None, replica: bool = False) -> Optional[tuple]:
+    with (_reader() if replica else pool).connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params or ())
             return cur.fetchone()
 
+def execute_returning(sql: str, params: Optional[tuple] = None) -> Optional[tuple]:
+    """Run a write on the primary and return its first RETURNING row."""
+    with _writer().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params or ())
+            row = cur.fetchone()
+            conn.commit()
+            return row
+
 def execute(sql: str, params: Optional[tuple] = None) -> None:
-    with pool.connection() as conn:
+    with _writer().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params or ())
             conn.commit()
@@ -91,7 +179,7 @@ def upsert_tag_get_id(name: str) -> int:
     ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
     RETURNING id;
     """
-    row = fetchone(sql, (name,))
+    row = execute_returning(sql, (name,))
     return row[0]
 
 def upsert_tags_get_ids(names: Iterable[str]) -> list[int]:
@@ -102,6 +190,17 @@ def upsert_tags_get_ids(names: Iterable[str]) -> list[int]:
         ids.append(upsert_tag_get_id(n))
     return ids
 
+def list_tags_with_counts(limit: int | None = None, offset: int = 0, replica: bool = True):
+    """List tags in use, most-used first, from the maintained tags.note_count column."""
+    sql = """
+    SELECT name, note_count
+    FROM tags
+    WHERE note_count > 0
+    ORDER BY note_count DESC, name ASC
+    LIMIT %s OFFSET %s;
+    """
+    return fetchall(sql, (limit, offset), replica=replica)
+
 def _vector_literal(vec: Iterable[float]) -> str:
     """Format a Python list of floats into a pgvector literal string."""
     return "[" + ",".join(f"{float(x):.7f}" for x in vec) + "]"
@@ -114,14 +213,15 @@ def insert_note_with_embedding(title: str, body: str, embedding: list[float]) ->
     VALUES (%s, %s, %s::vector)
     RETURNING id;
     """
-    row = fetchone(sql, (title, body, vec_str))
+    row = execute_returning(sql, (title, body, vec_str))
     return row[0]
 
 def link_note_tags(note_id: int, tag_ids: Iterable[int]) -> None:
-    vals: list[Tuple[int, int]] = [(note_id, tid) for tid in tag_ids]
+    # Sorted so concurrent writers lock tags rows (count trigger) in the same order
+    vals: list[Tuple[int, int]] = [(note_id, tid) for tid in sorted(set(tag_ids))]
     if not vals:
         return
-    with pool.connection() as conn:
+    with _writer().connection() as conn:
         with conn.cursor() as cur:
             cur.executemany(
                 "INSERT INTO note_tags (note_id, tag_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
@@ -141,37 +241,120 @@ def get_note_with_tags(note_id: int):
     LEFT JOIN note_tags nt ON nt.note_id = n.id
     LEFT JOIN tags t ON t.id = nt.tag_id
     WHERE n.id = %s
-    GROUP BY n.id;
+    GROUP BY n.id, n.title, n.body, n.created_at, n.updated_at;
     """
-    with pool.connection() as conn:
+    with _reader().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, (note_id,))
             return cur.fetchone()
 
-def list_notes_with_tags(limit: int = RESULT_LIMIT_DEFAULT, offset: int = 0):
-    """List notes (newest first) with aggregated tags."""
+def _created_at_filter(
+    alias: str,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+) -> Tuple[str, list]:
+    """
+    "AND ..." bounds on <alias>.created_at as a half-open range [after, before).
+    Only bounds that are set are emitted, so partitioned notes get pruned.
+    """
+    sql, params = "", []
+    if created_after is not None:
+        sql += f" AND {alias}.created_at >= %s"
+        params.append(created_after)
+    if created_before is not None:
+        sql += f" AND {alias}.created_at < %s"
+        params.append(created_before)
+    return sql, params
+
+def _snippet_expr(col: str, length: int | None, query_text: str | None = None) -> Tuple[str, list]:
+    """
+    SQL for a short preview of <col>, NULL when not requested.
+    With query text, ts_headline picks the best-matching passage; otherwise
+    the body is cut to `length` characters.
+    """
+    if not length:
+        return "NULL::text", []
+    if query_text:
+        words = max(5, length // 6)
+        opts = f'MaxWords={words}, MinWords={max(3, words // 2)}, StartSel="", StopSel=""'
+        return (
+            f"left(ts_headline('english', {col}, websearch_to_tsquery('english', %s), %s), %s)",
+            [query_text, opts, length],
+        )
+    return (
+        f"CASE WHEN char_length({col}) > %s THEN left({col}, %s) || '…' ELSE {col} END",
+        [length, length - 1],
+    )
+
+def _project_hits(
+    sql: str,
+    params: tuple,
+    include_body: bool = True,
+    snippet: int | None = None,
+    query_text: str | None = None,
+) -> Tuple[str, tuple]:
+    """
+    Wrap a ranked search query so body/snippet are only produced for the
+    final LIMIT rows. Rows come back as:
+      id, title, body, snippet, created_at, updated_at, tags, score
+    """
+    snip_sql, snip_params = _snippet_expr("s.body", snippet, query_text)
+    body_sql = "s.body" if include_body else "NULL::text"
+    wrapped = f"""
+    SELECT s.id, s.title, {body_sql} AS body, {snip_sql} AS snippet,
+           s.created_at, s.updated_at, s.tags, s.score
+    FROM ({sql.strip().rstrip(';')}) AS s
+    ORDER BY s.score DESC;
+    """
+    return wrapped, (*snip_params, *params)
+
+def list_notes_with_tags(
+    limit: int = RESULT_LIMIT_DEFAULT,
+    offset: int = 0,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    include_body: bool = True,
+    snippet: int | None = None,
+):
+    """
+    List notes (newest first) with aggregated tags.
+    Rows have the same shape as search hits, with a NULL score.
+    """
+    date_sql, date_params = _created_at_filter("n", created_after, created_before)
+    snip_sql, snip_params = _snippet_expr("n.body", snippet)
+    body_sql = "n.body" if include_body else "NULL::text"
     sql = """
     SELECT
-      n.id, n.title, n.body,
+      n.id, n.title, """ + body_sql + """ AS body, """ + snip_sql + """ AS snippet,
       to_char(n.created_at, 'YYYY-MM-DD"T"HH24:MI:SSOF') AS created_at,
       to_char(n.updated_at, 'YYYY-MM-DD"T"HH24:MI:SSOF') AS updated_at,
-      COALESCE(json_agg(t.name) FILTER (WHERE t.id IS NOT NULL), '[]') AS tags
+      COALESCE(json_agg(t.name) FILTER (WHERE t.id IS NOT NULL), '[]') AS tags,
+      NULL::float8 AS score
     FROM notes n
     LEFT JOIN note_tags nt ON nt.note_id = n.id
     LEFT JOIN tags t ON t.id = nt.tag_id
-    GROUP BY n.id
+    WHERE TRUE""" + date_sql + """
+    GROUP BY n.id, n.title, n.body, n.created_at, n.updated_at
     ORDER BY n.created_at DESC
     LIMIT %s OFFSET %s;
     """
-    with pool.connection() as conn:
+    with _reader().connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, (limit, offset))
+            cur.execute(sql, (*snip_params, *date_params, limit, offset))
             return cur.fetchall()
 
-def search_notes_by_vector(query_vec: list[float], limit: int | None = None):
+def search_notes_by_vector(
+    query_vec: list[float],
+    limit: int | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    include_body: bool = True,
+    snippet: int | None = None,
+):
     """Cosine similarity search over notes.embedding via pgvector."""
     vec_str = _vector_literal(query_vec)
     lim = limit or RESULT_LIMIT_DEFAULT
+    date_sql, date_params = _created_at_filter("n", created_after, created_before)
     sql = """
     WITH q AS (SELECT %s::vector AS v)
     SELECT
@@ -188,7 +371,7 @@ def search_notes_by_vector(query_vec: list[float], limit: int | None = None):
         n.*,
         (n.embedding <=> (SELECT v FROM q)) AS dist
       FROM notes n
-      WHERE n.embedding IS NOT NULL
+      WHERE n.embedding IS NOT NULL""" + date_sql + """
     ) AS n
     LEFT JOIN note_tags nt ON nt.note_id = n.id
     LEFT JOIN tags t ON t.id = nt.tag_id
@@ -196,10 +379,10 @@ def search_notes_by_vector(query_vec: list[float], limit: int | None = None):
     ORDER BY dist ASC
     LIMIT %s;
     """
-    with pool.connection() as conn:
+    with _reader().connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(ANN_PROBES),))
-            cur.execute(sql, (vec_str, lim))
+            cur.execute(*_project_hits(sql, (vec_str, *date_params, lim), include_body, snippet))
             return cur.fetchall()
         
 def _norm_tags_list(names: Iterable[str]) -> list[str]:
@@ -210,11 +393,16 @@ def search_notes_by_vector_filtered(
     limit: int | None = None,
     tags: list[str] | None = None,
     match: str = "any", 
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    include_body: bool = True,
+    snippet: int | None = None,
 ):
     vec_str = _vector_literal(query_vec)
     lim = limit or RESULT_LIMIT_DEFAULT
     tags = _norm_tags_list(tags or [])
     want_tags = len(tags) > 0
+    date_sql, date_params = _created_at_filter("n", created_after, created_before)
 
     base = """
     WITH q AS (SELECT %s::vector AS v),
@@ -222,7 +410,7 @@ def search_notes_by_vector_filtered(
       SELECT n.id, n.title, n.body, n.created_at, n.updated_at,
              (n.embedding <=> (SELECT v FROM q)) AS dist
       FROM notes n
-      WHERE n.embedding IS NOT NULL
+      WHERE n.embedding IS NOT NULL""" + date_sql + """
     )
     """
 
@@ -241,10 +429,10 @@ def search_notes_by_vector_filtered(
         ORDER BY v.dist ASC
         LIMIT %s;
         """
-        with pool.connection() as conn:
+        with _reader().connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(ANN_PROBES),))
-                cur.execute(sql, (vec_str, lim))
+                cur.execute(*_project_hits(sql, (vec_str, *date_params, lim), include_body, snippet))
                 return cur.fetchall()
 
     if match == "all":
@@ -270,13 +458,14 @@ def search_notes_by_vector_filtered(
         ) f
         LEFT JOIN note_tags nt2 ON nt2.note_id = f.id
         LEFT JOIN tags t2 ON t2.id = nt2.tag_id
+        GROUP BY f.id, f.title, f.body, f.created_at, f.updated_at, f.dist
         ORDER BY f.dist ASC
         LIMIT %s;
         """
-        with pool.connection() as conn:
+        with _reader().connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(ANN_PROBES),))
-                cur.execute(sql, (vec_str, tags, len(tags), lim))
+                cur.execute(*_project_hits(sql, (vec_str, *date_params, tags, len(tags), lim), include_body, snippet))
                 return cur.fetchall()
     else:
         sql = base + """
@@ -301,10 +490,10 @@ def search_notes_by_vector_filtered(
         ORDER BY v.dist ASC
         LIMIT %s;
         """
-        with pool.connection() as conn:
+        with _reader().connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(ANN_PROBES),))
-                cur.execute(sql, (vec_str, tags, lim))
+                cur.execute(*_project_hits(sql, (vec_str, *date_params, tags, lim), include_body, snippet))
                 return cur.fetchall()
 
 
@@ -315,17 +504,22 @@ def search_notes_hybrid_filtered(
     tags: list[str] | None = None,
     match: str = "any",
     alpha: float = 0.70,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    include_body: bool = True,
+    snippet: int | None = None,
 ):
     """
     Hybrid search: fuse vector similarity (pgvector) with full-text rank.
     score = alpha*(1 - dist) + (1 - alpha)*norm_rank
     where norm_rank = r / (r + 1) to map ts_rank_cd into 0..1.
-    Supports tag filters with "any" (OR) or "all" (AND).
+    Supports tag filters with "any" (OR) or "all" (AND) and a created_at range.
     """
     vec_str = _vector_literal(query_vec)
     lim = limit or RESULT_LIMIT_DEFAULT
     tags = _norm_tags_list(tags or [])
     want_tags = len(tags) > 0
+    date_sql, date_params = _created_at_filter("n", created_after, created_before)
 
     base = """
     WITH qv AS (SELECT %s::vector AS v),
@@ -334,7 +528,7 @@ def search_notes_hybrid_filtered(
            SELECT n.id, n.title, n.body, n.created_at, n.updated_at, n.fts,
                   (n.embedding <=> (SELECT v FROM qv)) AS dist
            FROM notes n
-           WHERE n.embedding IS NOT NULL
+           WHERE n.embedding IS NOT NULL""" + date_sql + """
          ),
          ranked AS (
            SELECT v.*, ts_rank_cd(v.fts, (SELECT tsq FROM qt)) AS r
@@ -358,10 +552,10 @@ def search_notes_hybrid_filtered(
         ORDER BY score DESC
         LIMIT %s;
         """
-        with pool.connection() as conn:
+        with _reader().connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(ANN_PROBES),))
-                cur.execute(sql, (vec_str, query_text, alpha, alpha, lim))
+                cur.execute(*_project_hits(sql, (vec_str, query_text, *date_params, alpha, alpha, lim), include_body, snippet, query_text))
                 return cur.fetchall()
 
     if match == "all":
@@ -389,10 +583,10 @@ def search_notes_hybrid_filtered(
         ORDER BY score DESC
         LIMIT %s;
         """
-        with pool.connection() as conn:
+        with _reader().connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(ANN_PROBES),))
-                cur.execute(sql, (vec_str, query_text, tags, len(tags), alpha, alpha, lim))
+                cur.execute(*_project_hits(sql, (vec_str, query_text, *date_params, tags, len(tags), alpha, alpha, lim), include_body, snippet, query_text))
                 return cur.fetchall()
     else:
         sql = base + """
@@ -418,31 +612,63 @@ def search_notes_hybrid_filtered(
         ORDER BY score DESC
         LIMIT %s;
         """
-        with pool.connection() as conn:
+        with _reader().connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(ANN_PROBES),))
-                cur.execute(sql, (vec_str, query_text, tags, alpha, alpha, lim))
+                cur.execute(*_project_hits(sql, (vec_str, query_text, *date_params, tags, alpha, alpha, lim), include_body, snippet, query_text))
                 return cur.fetchall()
         
-def update_note_and_embedding(note_id: int, title: str, body: str, embedding: list[float]) -> bool:
+def get_note_for_update(note_id: int) -> Optional[tuple]:
+    """Current (title, body, updated_at) from the primary, for a conditional update."""
+    return fetchone("SELECT title, body, updated_at FROM notes WHERE id = %s;", (note_id,))
+
+def update_note_and_embedding(
+    note_id: int,
+    title: str,
+    body: str,
+    embedding: list[float],
+    expected_updated_at: datetime | None = None,
+) -> bool:
+    """
+    Update a note and its embedding. With expected_updated_at, only applies if
+    the row hasn't changed since it was read; returns False otherwise.
+    """
     vec_str = _vector_literal(embedding)
+    params: tuple = (title, body, vec_str, note_id)
+    guard = ""
+    if expected_updated_at is not None:
+        guard = " AND updated_at = %s"
+        params += (expected_updated_at,)
     sql = """
     UPDATE notes
     SET title = %s,
         body  = %s,
         embedding = %s::vector,
         updated_at = now()
-    WHERE id = %s
+    WHERE id = %s""" + guard + """
     RETURNING id;
     """
-    row = fetchone(sql, (title, body, vec_str, note_id))
+    row = execute_returning(sql, params)
     return bool(row)
 
 def replace_note_tags(note_id: int, tag_ids: Iterable[int]) -> None:
-    with pool.connection() as conn:
+    new_ids = sorted(set(tag_ids))
+    with _writer().connection() as conn:
         with conn.cursor() as cur:
+            # Lock every tags row the count trigger will touch, in id order,
+            # so concurrent replacements can't deadlock on them.
+            cur.execute(
+                """
+                SELECT id FROM tags
+                WHERE id = ANY (%s)
+                   OR id IN (SELECT tag_id FROM note_tags WHERE note_id = %s)
+                ORDER BY id
+                FOR NO KEY UPDATE;
+                """,
+                (new_ids, note_id),
+            )
             cur.execute("DELETE FROM note_tags WHERE note_id = %s;", (note_id,))
-            vals = [(note_id, tid) for tid in tag_ids]
+            vals = [(note_id, tid) for tid in new_ids]
             if vals:
                 cur.executemany(
                     "INSERT INTO note_tags (note_id, tag_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
@@ -1,11 +1,14 @@
 # app/main.py
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
-from .config import ALLOW_CORS_ALL
-from .db import init_db, close_db
+from .config import ALLOW_CORS_ALL, READ_YOUR_WRITES_SECONDS, GZIP_MIN_SIZE
+from .db import init_db, close_db, begin_request, end_request
 from . import routes
 
 app = FastAPI(title="Personal Knowledge Base")
@@ -18,6 +21,36 @@ if ALLOW_CORS_ALL:
         allow_headers=["*"],
     )
 
+# Compress larger JSON responses for clients sending Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+
+# Read-your-writes: after a client writes, its reads stay on the primary
+# until the cookie's timestamp passes (only matters with DATABASE_READ_URL).
+RYW_COOKIE = "pkb_primary_until"
+
+@app.middleware("http")
+async def _route_reads(request: Request, call_next):
+    try:
+        pinned = float(request.cookies.get(RYW_COOKIE, "0")) > time.time()
+    except ValueError:
+        pinned = False
+
+    token = begin_request(pinned=pinned)
+    try:
+        response = await call_next(request)
+    finally:
+        wrote = end_request(token)
+
+    if wrote and READ_YOUR_WRITES_SECONDS > 0:
+        response.set_cookie(
+            RYW_COOKIE,
+            f"{time.time() + READ_YOUR_WRITES_SECONDS:.3f}",
+            max_age=max(1, int(READ_YOUR_WRITES_SECONDS + 0.999)),
+            httponly=True,
+            samesite="lax",
+        )
+    return response
+
 app.include_router(routes.router)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -1,4 +1,5 @@
-from typing import List, Optional, Literal
+from datetime import datetime
+from typing import Dict, List, Optional, Literal
 from pydantic import BaseModel, Field
 
 class NoteCreate(BaseModel):
@@ -15,6 +16,20 @@ class NoteOut(BaseModel):
     updated_at: str
     score: Optional[float] = None
 
+# Fields a search/list hit can be projected to with `fields=`
+NoteField = Literal["id", "title", "body", "snippet", "tags", "created_at", "updated_at", "score"]
+
+class NoteHitOut(BaseModel):
+    """Search/list hit; only the requested fields are present."""
+    id: Optional[int] = None
+    title: Optional[str] = None
+    body: Optional[str] = None
+    snippet: Optional[str] = None
+    tags: Optional[List[str]] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    score: Optional[float] = None
+
 class NoteListParams(BaseModel):
     limit: int = 20
     offset: int = 0
@@ -29,4 +44,17 @@ class SearchIn(BaseModel):
     limit: int | None = None
     tags: Optional[List[str]] = None
     match: Literal["any", "all"] = "any"
-    mode: Literal["vector", "hybrid"] = "hybrid" 
\ No newline at end of file
+    mode: Literal["vector", "hybrid"] = "hybrid"
+    facets: bool = False
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    fields: Optional[List[NoteField]] = None
+    snippet: Optional[int] = Field(default=None, ge=20, le=2000)
+
+class SearchOut(BaseModel):
+    results: List[NoteHitOut]
+    facets: Dict[str, int]
+
+class TagOut(BaseModel):
+    name: str
+    count: int
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Body, HTTPException, Query
-from typing import List
-from .config import ENABLE_FTS, FUSION_ALPHA
+from fastapi.responses import ORJSONResponse
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional, Union
+from .config import ENABLE_FTS, FUSION_ALPHA, SNIPPET_LENGTH_DEFAULT
 from .db import (
     db_diagnostics,
     insert_note_with_embedding,
@@ -8,15 +11,18 @@ from .db import (
     link_note_tags,
     get_note_with_tags,
     list_notes_with_tags,
-    execute, fetchone,
+    execute_returning,
     search_notes_by_vector,
     search_notes_by_vector_filtered,
+    get_note_for_update,
     update_note_and_embedding,
     replace_note_tags,
-    search_notes_hybrid_filtered
+    search_notes_hybrid_filtered,
+    list_tags_with_counts,
 )
 from .embeddings import generate_embedding
-from .models import NoteCreate, NoteOut, SearchIn, NoteUpdate
+from .models import NoteCreate, NoteOut, NoteHitOut, SearchIn, SearchOut, NoteUpdate, TagOut
+from . import tag_index
 
 router = APIRouter()
 
@@ -70,6 +76,8 @@ def create_note(payload: NoteCreate):
     note_id = insert_note_with_embedding(payload.title, payload.body, vec)
 
     link_note_tags(note_id, tag_ids)
+    if tag_ids:
+        tag_index.invalidate()
 
     row = get_note_with_tags(note_id)
     if not row:
@@ -84,20 +92,59 @@ def create_note(payload: NoteCreate):
         tags=row[5] or [],
     )
 
-@router.get("/notes", response_model=List[NoteOut])
-def list_notes(limit: int = Query(20, ge=1, le=200), offset: int = Query(0, ge=0)):
-    rows = list_notes_with_tags(limit=limit, offset=offset)
-    out: List[NoteOut] = []
-    for r in rows:
-        out.append(NoteOut(
-            id=r[0],
-            title=r[1],
-            body=r[2],
-            created_at=r[3],
-            updated_at=r[4],
-            tags=r[5] or [],
-        ))
-    return out
+def _check_date_range(created_after: Optional[datetime], created_before: Optional[datetime]) -> None:
+    if not (created_after and created_before):
+        return
+    try:
+        inverted = created_after >= created_before
+    except TypeError:
+        # one naive, one aware: leave it to Postgres' session timezone
+        return
+    if inverted:
+        raise HTTPException(status_code=400, detail="created_after must be earlier than created_before")
+
+# Column order of rows from list_notes_with_tags and the search_* queries
+HIT_COLUMNS = ("id", "title", "body", "snippet", "created_at", "updated_at", "tags", "score")
+DEFAULT_HIT_FIELDS = ["id", "title", "body", "tags", "created_at", "updated_at", "score"]
+
+def _resolve_fields(fields: Optional[List[str]], snippet: Optional[int]) -> tuple[list[str], Optional[int]]:
+    """Validate a projection; asking for a snippet implies the field and vice versa."""
+    fields = list(dict.fromkeys(fields)) if fields else list(DEFAULT_HIT_FIELDS)
+    unknown = [f for f in fields if f not in HIT_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if snippet and "snippet" not in fields:
+        fields.append("snippet")
+    if "snippet" in fields and not snippet:
+        snippet = SNIPPET_LENGTH_DEFAULT
+    return fields, snippet
+
+def _hit_dicts(rows, fields: list[str]) -> list[dict]:
+    """Build response dicts straight from rows, skipping model construction."""
+    idx = [(f, HIT_COLUMNS.index(f)) for f in fields]
+    return [{f: r[i] for f, i in idx} for r in rows]
+
+@router.get("/notes", response_model=List[NoteHitOut])
+def list_notes(
+    limit: int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    created_after: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    snippet: Optional[int] = Query(None, ge=20, le=2000),
+):
+    _check_date_range(created_after, created_before)
+    wanted = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    cols, snippet = _resolve_fields(wanted, snippet)
+    rows = list_notes_with_tags(
+        limit=limit,
+        offset=offset,
+        created_after=created_after,
+        created_before=created_before,
+        include_body="body" in cols,
+        snippet=snippet,
+    )
+    return ORJSONResponse(_hit_dicts(rows, cols))
 
 @router.get("/notes/{note_id}", response_model=NoteOut)
 def get_note(note_id: int):
@@ -115,17 +162,29 @@ def get_note(note_id: int):
 
 @router.delete("/notes/{note_id}")
 def delete_note(note_id: int):
-    res = fetchone("DELETE FROM notes WHERE id = %s RETURNING id;", (note_id,))
+    res = execute_returning("DELETE FROM notes WHERE id = %s RETURNING id;", (note_id,))
     if not res:
         raise HTTPException(status_code=404, detail="Note not found")
+    tag_index.invalidate()
     return {"status": "ok", "deleted": note_id}
 
+@router.get("/tags", response_model=List[TagOut])
+def list_tags(limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    rows = list_tags_with_counts(limit=limit, offset=offset)
+    return [TagOut(name=r[0], count=r[1]) for r in rows]
+
+@router.get("/tags/suggest", response_model=List[TagOut])
+def suggest_tags(prefix: str = Query("", max_length=100), limit: int = Query(10, ge=1, le=50)):
+    return [TagOut(name=n, count=c) for n, c in tag_index.suggest(prefix, limit)]
+
 
-@router.post("/search", response_model=List[NoteOut])
+@router.post("/search", response_model=Union[List[NoteHitOut], SearchOut])
 def search(payload: SearchIn):
     q = (payload.q or "").strip()
     if not q:
         raise HTTPException(status_code=400, detail="Query text 'q' is required")
+    _check_date_range(payload.created_after, payload.created_before)
+    cols, snippet = _resolve_fields(payload.fields, payload.snippet)
 
     vec = generate_embedding(q)
 
@@ -139,6 +198,10 @@ def search(payload: SearchIn):
             tags=(payload.tags or None),
             match=payload.match,
             alpha=FUSION_ALPHA,
+            created_after=payload.created_after,
+            created_before=payload.created_before,
+            include_body="body" in cols,
+            snippet=snippet,
         )
     else:
         rows = search_notes_by_vector_filtered(
@@ -146,43 +209,56 @@ def search(payload: SearchIn):
             limit=payload.limit,
             tags=(payload.tags or None),
             match=payload.match,
+            created_after=payload.created_after,
+            created_before=payload.created_before,
+            include_body="body" in cols,
+            snippet=snippet,
         )
 
-    out: List[NoteOut] = []
-    for r in rows:
-        score_idx = 8 if (use_hybrid and len(r) > 8) else 7
-        score_val = float(r[score_idx]) if (len(r) > score_idx and r[score_idx] is not None) else None
-        out.append(NoteOut(
-            id=r[0], title=r[1], body=r[2],
-            created_at=r[3], updated_at=r[4],
-            tags=r[5] or [],
-            score=score_val,
-        ))
-    return out
+    hits = _hit_dicts(rows, cols)
 
+    if payload.facets:
+        # Facets come from the tags already aggregated on each hit
+        tags_idx = HIT_COLUMNS.index("tags")
+        facets = Counter(t for r in rows for t in (r[tags_idx] or []))
+        return ORJSONResponse({"results": hits, "facets": dict(facets.most_common())})
+    return ORJSONResponse(hits)
+
+
+UPDATE_RETRIES = 3
 
 @router.put("/notes/{note_id}", response_model=NoteOut)
 def update_note(note_id: int, payload: NoteUpdate):
-    row = get_note_with_tags(note_id)
-    if not row:
-        raise HTTPException(status_code=404, detail="Note not found")
-    cur_title, cur_body = row[1], row[2]
+    for given in (payload.title, payload.body):
+        if given is not None and not given.strip():
+            raise HTTPException(status_code=400, detail="Title and body cannot be empty")
 
-    new_title = (payload.title if payload.title is not None else cur_title).strip()
-    new_body  = (payload.body  if payload.body  is not None else cur_body).strip()
-    if not new_title or not new_body:
-        raise HTTPException(status_code=400, detail="Title and body cannot be empty")
+    # Optimistic read-modify-write: fill missing fields from the primary,
+    # embed outside any transaction, and only apply the update if the row
+    # is unchanged since it was read.
+    for _ in range(UPDATE_RETRIES):
+        row = get_note_for_update(note_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Note not found")
+        cur_title, cur_body, cur_updated_at = row
 
-    to_embed = f"{new_title}\n\n{new_body}"
-    vec = generate_embedding(to_embed)
+        new_title = (payload.title if payload.title is not None else cur_title).strip()
+        new_body  = (payload.body  if payload.body  is not None else cur_body).strip()
+        if not new_title or not new_body:
+            raise HTTPException(status_code=400, detail="Title and body cannot be empty")
 
-    ok = update_note_and_embedding(note_id, new_title, new_body, vec)
-    if not ok:
-        raise HTTPException(status_code=500, detail="Failed to update note")
+        to_embed = f"{new_title}\n\n{new_body}"
+        vec = generate_embedding(to_embed)
+
+        if update_note_and_embedding(note_id, new_title, new_body, vec, expected_updated_at=cur_updated_at):
+            break
+    else:
+        raise HTTPException(status_code=409, detail="Note was modified concurrently, please retry")
 
     if payload.tags is not None:
         tag_ids = upsert_tags_get_ids(payload.tags)
         replace_note_tags(note_id, tag_ids)
+        tag_index.invalidate()
 
     row = get_note_with_tags(note_id)
     return NoteOut(
@@ -0,0 +1,62 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import List, Tuple
+
+from .config import TAG_INDEX_TTL_SECONDS
+from .db import list_tags_with_counts
+
+# In-process prefix index over tag names, built from tags.note_count.
+# Writes call invalidate(); the next lookup reloads it from the database.
+# Writes handled by other workers/instances are picked up once the index
+# is older than TAG_INDEX_TTL_SECONDS.
+_lock = threading.Lock()
+# (sorted names, counts) published as one tuple so readers never see a mix
+_index: Tuple[List[str], List[int]] = ([], [])
+_stale = True
+_loaded_at = 0.0
+
+
+def invalidate() -> None:
+    """Mark the index stale after tag links change."""
+    global _stale
+    _stale = True
+
+
+def _needs_refresh() -> bool:
+    return _stale or time.monotonic() - _loaded_at > TAG_INDEX_TTL_SECONDS
+
+
+def refresh(force: bool = True) -> None:
+    """Reload the sorted (name, count) arrays from the database."""
+    global _index, _stale, _loaded_at
+    with _lock:
+        # Threads that queued behind another reload don't repeat it
+        if not force and not _needs_refresh():
+            return
+        _stale = False
+        try:
+            # Primary, so a lagging replica can't get cached until the next write
+            rows = sorted(list_tags_with_counts(replica=False), key=lambda r: r[0])
+        except Exception:
+            _stale = True
+            raise
+        _index = ([r[0] for r in rows], [int(r[1]) for r in rows])
+        _loaded_at = time.monotonic()
+
+
+def suggest(prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+    """Tags starting with prefix, most-used first."""
+    if _needs_refresh():
+        refresh(force=False)
+    prefix = prefix.strip().lower()
+    names, counts = _index
+
+    i = bisect_left(names, prefix)
+    hits: List[Tuple[str, int]] = []
+    while i < len(names) and names[i].startswith(prefix):
+        hits.append((names[i], counts[i]))
+        i += 1
+
+    hits.sort(key=lambda h: (-h[1], h[0]))
+    return hits[:limit]
@@ -0,0 +1,163 @@
+-- Optional: range-partition notes by created_at.
+-- Run after schema.sql. Converts an existing (heap) notes table in place;
+-- re-running is a no-op apart from topping up future partitions.
+--
+--   docker exec -it pkb-db psql -U pkb -d pkb -f /partition_notes.sql
+--
+-- Every partition gets its own ivfflat, FTS and created_at indexes, so a
+-- date-bounded search only scans the partitions in range.
+
+-- Create one partition per month (or year) covering [p_from, p_to).
+-- Rows that already landed in notes_default for a new partition's range are
+-- moved into it; otherwise Postgres refuses to create the partition.
+CREATE OR REPLACE FUNCTION notes_ensure_partitions(
+  p_from TIMESTAMPTZ,
+  p_to   TIMESTAMPTZ,
+  p_unit TEXT DEFAULT 'month'
+) RETURNS void AS $$
+DECLARE
+  step  INTERVAL := ('1 ' || p_unit)::interval;
+  lo    TIMESTAMPTZ := date_trunc(p_unit, p_from);
+  part  TEXT;
+  stray BOOLEAN;
+BEGIN
+  IF p_unit NOT IN ('month', 'year') THEN
+    RAISE EXCEPTION 'p_unit must be month or year, got %', p_unit;
+  END IF;
+  WHILE lo < p_to LOOP
+    part := 'notes_' || to_char(lo, CASE p_unit WHEN 'year' THEN '"y"YYYY' ELSE '"y"YYYY"m"MM' END);
+    IF to_regclass('public.' || part) IS NULL THEN
+      stray := to_regclass('public.notes_default') IS NOT NULL
+        AND EXISTS (SELECT 1 FROM public.notes_default WHERE created_at >= lo AND created_at < lo + step);
+
+      IF stray THEN
+        -- Detached, notes_default loses its cloned delete trigger, so moving
+        -- rows out of it leaves their note_tags alone.
+        ALTER TABLE public.notes DETACH PARTITION public.notes_default;
+      END IF;
+
+      EXECUTE format(
+        'CREATE TABLE public.%I PARTITION OF public.notes FOR VALUES FROM (%L) TO (%L);',
+        part, lo, lo + step
+      );
+
+      IF stray THEN
+        INSERT INTO public.notes (id, title, body, created_at, updated_at, embedding)
+        SELECT id, title, body, created_at, updated_at, embedding
+        FROM public.notes_default
+        WHERE created_at >= lo AND created_at < lo + step;
+        DELETE FROM public.notes_default WHERE created_at >= lo AND created_at < lo + step;
+        ALTER TABLE public.notes ATTACH PARTITION public.notes_default DEFAULT;
+      END IF;
+    END IF;
+    lo := lo + step;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- note_tags can't reference a partitioned notes(id) (the key must include
+-- created_at), so deletes cascade through this trigger instead.
+CREATE OR REPLACE FUNCTION notes_delete_tags_trg() RETURNS trigger AS $$
+BEGIN
+  DELETE FROM note_tags WHERE note_id = OLD.id;
+  RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Archive a partition: detach it from notes and move its tag links into
+-- note_tags_archive. The note_tags count trigger then lowers tags.note_count,
+-- so /tags and suggestions stop including archived notes.
+-- Returns the number of tag links moved.
+CREATE TABLE IF NOT EXISTS note_tags_archive (
+  note_id BIGINT NOT NULL,
+  tag_id  BIGINT NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+  PRIMARY KEY (note_id, tag_id)
+);
+
+CREATE OR REPLACE FUNCTION notes_archive_partition(p_part REGCLASS) RETURNS BIGINT AS $$
+DECLARE
+  moved BIGINT;
+BEGIN
+  EXECUTE format('ALTER TABLE public.notes DETACH PARTITION %s;', p_part);
+  EXECUTE format(
+    'WITH gone AS (
+       DELETE FROM note_tags
+       WHERE note_id IN (SELECT id FROM %s)
+       RETURNING note_id, tag_id
+     )
+     INSERT INTO note_tags_archive (note_id, tag_id)
+     SELECT note_id, tag_id FROM gone
+     ON CONFLICT DO NOTHING;',
+    p_part
+  );
+  GET DIAGNOSTICS moved = ROW_COUNT;
+  RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  lo TIMESTAMPTZ;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = 'public.notes'::regclass) = 'p' THEN
+    RAISE NOTICE 'notes is already partitioned';
+    RETURN;
+  END IF;
+
+  ALTER TABLE note_tags DROP CONSTRAINT IF EXISTS note_tags_note_id_fkey;
+  ALTER TABLE notes RENAME TO notes_heap;
+  ALTER SEQUENCE notes_id_seq OWNED BY NONE;
+
+  CREATE TABLE notes (
+    id          BIGINT NOT NULL DEFAULT nextval('notes_id_seq'),
+    title       TEXT NOT NULL,
+    body        TEXT NOT NULL,
+    created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    embedding   VECTOR(1536),
+    fts         TSVECTOR GENERATED ALWAYS AS
+                  (to_tsvector('simple', coalesce(title,'') || ' ' || coalesce(body,''))) STORED,
+    PRIMARY KEY (id, created_at)
+  ) PARTITION BY RANGE (created_at);
+
+  ALTER SEQUENCE notes_id_seq OWNED BY notes.id;
+
+  SELECT COALESCE(MIN(created_at), NOW()) INTO lo FROM notes_heap;
+  PERFORM notes_ensure_partitions(lo, NOW() + INTERVAL '3 months');
+  CREATE TABLE notes_default PARTITION OF notes DEFAULT;
+
+  INSERT INTO notes (id, title, body, created_at, updated_at, embedding)
+  SELECT id, title, body, created_at, updated_at, embedding FROM notes_heap;
+
+  DROP TABLE notes_heap;
+END;
+$$;
+
+-- Defined on the parent, so every current and future partition gets its own copy
+CREATE INDEX IF NOT EXISTS idx_notes_id ON notes (id);
+CREATE INDEX IF NOT EXISTS idx_notes_created_at_desc ON notes (created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_notes_title_trgm ON notes USING GIN (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_notes_fts ON notes USING GIN (fts);
+CREATE INDEX IF NOT EXISTS idx_notes_embedding_ivfflat
+  ON notes
+  USING ivfflat (embedding vector_cosine_ops)
+  WITH (lists = 100);
+
+DROP TRIGGER IF EXISTS trg_notes_delete_tags ON notes;
+CREATE TRIGGER trg_notes_delete_tags
+  AFTER DELETE ON notes
+  FOR EACH ROW EXECUTE FUNCTION notes_delete_tags_trg();
+
+SELECT notes_ensure_partitions(NOW(), NOW() + INTERVAL '3 months');
+
+-- Maintenance:
+--   * The app tops up the next few months of partitions on startup; rows
+--     outside any partition land in notes_default.
+--   * ivfflat centroids are trained when an index is built, and partitions
+--     are created empty. Once a month has filled up, rebuild its index:
+--       REINDEX INDEX CONCURRENTLY notes_y2025m10_embedding_idx;
+--   * Archive an old partition (it stops appearing in search/list and in
+--     tag counts), then dump or move it to cheaper storage as a plain table:
+--       SELECT notes_archive_partition('notes_y2019m01');
+--     Its tag links are kept in note_tags_archive. To restore, re-attach the
+--     table and INSERT its links back into note_tags.
@@ -18,12 +18,47 @@ CREATE TABLE IF NOT EXISTS tags (
   name TEXT NOT NULL UNIQUE
 );
 
+-- Maintained note count per tag (kept in sync by trg_note_tags_count below)
+ALTER TABLE tags ADD COLUMN IF NOT EXISTS note_count INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_tags_note_count_desc ON tags (note_count DESC, name);
+
 CREATE TABLE IF NOT EXISTS note_tags (
   note_id BIGINT NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
   tag_id  BIGINT NOT NULL REFERENCES tags(id)  ON DELETE CASCADE,
   PRIMARY KEY (note_id, tag_id)
 );
 
+CREATE INDEX IF NOT EXISTS idx_note_tags_tag_id ON note_tags (tag_id);
+
+CREATE OR REPLACE FUNCTION note_tags_count_trg() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE tags SET note_count = note_count + 1 WHERE id = NEW.tag_id;
+    RETURN NEW;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE tags SET note_count = GREATEST(note_count - 1, 0) WHERE id = OLD.tag_id;
+    RETURN OLD;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_note_tags_count ON note_tags;
+CREATE TRIGGER trg_note_tags_count
+  AFTER INSERT OR DELETE ON note_tags
+  FOR EACH ROW EXECUTE FUNCTION note_tags_count_trg();
+
+-- Backfill counts (safe to re-run)
+UPDATE tags t
+SET note_count = c.cnt
+FROM (
+  SELECT t2.id, COUNT(nt.note_id) AS cnt
+  FROM tags t2
+  LEFT JOIN note_tags nt ON nt.tag_id = t2.id
+  GROUP BY t2.id
+) c
+WHERE c.id = t.id AND t.note_count IS DISTINCT FROM c.cnt;
+
 DROP INDEX IF EXISTS idx_notes_embedding_ivfflat;
 CREATE INDEX idx_notes_embedding_ivfflat
   ON notes